@@ -1,10 +1,20 @@
 import os
 import json
 import requests
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import re
+import heapq
 import urllib.parse
 import time
 import random
+import logging
+from functools import lru_cache
+from operator import itemgetter
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from pathlib import Path
@@ -16,8 +26,15 @@ LOG_PATH = BASE_DIR / "xp_log.json"
 STATE_PATH = BASE_DIR / "post_state.json"
 STREAKS_PATH = BASE_DIR / "streaks.json"
 PB_PATH = BASE_DIR / "personal_bests.json"
+ETAGS_PATH = BASE_DIR / "etags.json"
 TIMEZONE = "Europe/London"
-MAX_XP_THRESHOLD = 200000000 
+MAX_XP_THRESHOLD = 200000000
+XP_VALUE_RE = re.compile(rb"text-(?:green|red)-400\">([+-][\d,.]+)")
+MEDALS = ("🥇", "🥈", "🥉")
+LEGEND_BASE = "⭐️=PB | 🔥=Streak"
+
+logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("xp")
 
 # --- 🎬 GIF CONFIGURATION (VERIFIED GOT KING POOL) ---
 KING_GIFS = [
@@ -31,29 +48,81 @@ KING_GIFS = [
 # ==========================================
 # 🛠️ THE DATA SCRAPER
 # ==========================================
-def fetch_data(name, dates):
-    bridge_url = os.environ.get("GOOGLE_BRIDGE_URL")
-    if not bridge_url: return 0
+class RateLimiter:
+    # Token bucket shared by the scraper threads — concurrency must not turn into a burst
+    def __init__(self, rate, burst):
+        self.rate, self.capacity = rate, burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait_for_token(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                needed = (1 - self.tokens) / self.rate
+            time.sleep(needed)
+
+SCRAPE_LIMITER = RateLimiter(rate=2.0, burst=4)
+
+_thread_local = threading.local()
+
+def get_session():
+    # One Session per worker thread so keep-alive connections are reused across scrapes
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        # We only ever want the HTML document itself, never assets
+        session.headers.update({"Accept": "text/html", "Accept-Encoding": "gzip, deflate", "User-Agent": "Mozilla/5.0 (xp-tracker)"})
+        retries = requests.adapters.Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
+        _thread_local.session = session
+    return session
+
+def fetch_data(name, dates, etags=None):
     formatted_name = "+".join([word.capitalize() for word in name.split()])
     target_url = f"https://guildstats.eu/include/character/tab.php?nick={formatted_name}&tab=experience"
-    final_url = f"{bridge_url}?url={urllib.parse.quote(target_url)}"
+    # The bridge is only a proxy around static HTML — hit guildstats directly when it isn't configured
+    bridge_url = os.environ.get("GOOGLE_BRIDGE_URL")
+    final_url = f"{bridge_url}?url={urllib.parse.quote(target_url)}" if bridge_url else target_url
     try:
-        r = requests.get(final_url, timeout=45)
+        headers = {}
+        meta = etags.get(name) if etags is not None else None
+        if isinstance(meta, str): meta = {"etag": meta}  # pre-Last-Modified sidecar format
+        if meta:
+            if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+        # Fail fast on a dead host (5s connect) while still allowing a slow bridge render (30s read)
+        SCRAPE_LIMITER.wait_for_token()
+        r = get_session().get(final_url, timeout=(5, 30), headers=headers)
+        # 304 = page unchanged since last scrape, so yesterday's row isn't up yet
+        if r.status_code == 304: return 0
         if r.status_code != 200: return 0
+        if etags is not None and (r.headers.get("ETag") or r.headers.get("Last-Modified")):
+            etags[name] = {"etag": r.headers.get("ETag", ""), "last_modified": r.headers.get("Last-Modified", "")}
         
-        # Pull XP
+        # Pull XP — work on the raw bytes (dates/values are ASCII) so the body is never str-decoded,
+        # and narrow to the experience table slice so we don't row-scan the whole page
         xp_gain = 0
-        rows = r.text.split('<tr')
-        for row in rows:
-            if dates['yesterday_iso'] in row:
-                match = re.search(r"text-(?:green|red)-400\">([+-][\d,.]+)", row)
+        html = r.content
+        start = html.find(b'id="tabs1"')
+        if start != -1:
+            end = html.find(b'</table>', start)
+            html = html[start:end] if end != -1 else html[start:]
+        yesterday = dates['yesterday_iso'].encode()
+        search = XP_VALUE_RE.search
+        for row in html.split(b'<tr'):
+            if yesterday in row:
+                match = search(row)
                 if match:
-                    raw_val = match.group(1)
-                    digits = "".join(c for c in raw_val if c.isdigit())
-                    if digits:
-                        val = int(digits)
-                        if val < MAX_XP_THRESHOLD:
-                            xp_gain = -val if '-' in raw_val else val
+                    val = xp_str_to_int(match.group(1).decode())
+                    if val and abs(val) < MAX_XP_THRESHOLD:
+                        xp_gain = val
         return xp_gain
     except: return 0
 
@@ -71,8 +140,11 @@ def update_personal_best(name, current_gain):
         return True
     return False
 
+def default_streaks():
+    return {"daily": {}, "weekly": {}, "monthly": {}, "reigning_king": ""}
+
 def update_period_streak(category, winner_name):
-    all_streaks = load_json(STREAKS_PATH, {"daily":{}, "weekly":{}, "monthly":{}, "reigning_king": ""})
+    all_streaks = load_json(STREAKS_PATH, default_streaks())
     data = all_streaks.get(category, {})
     last_winner = data.get("last_winner", "")
     last_count = data.get("count", 0)
@@ -111,16 +183,17 @@ def make_bar(val, max_val):
     filled = max(0, min(10, round((val / max_val) * 10)))
     return "🟩" * filled + "⬛" * (10 - filled)
 
-def send_discord_post(title, subtitle, ranking, color, dates, streak_cat=None, pb_list=None):
-    webhook = os.environ.get("DISCORD_WEBHOOK_URL")
-    if not webhook or not ranking: return
+def build_discord_embed(title, subtitle, ranking, color, dates, streak_cat=None, pb_list=None):
+    if not os.environ.get("DISCORD_WEBHOOK_URL") or not ranking: return None
     pb_list = pb_list or []
-    max_xp = ranking[0][1]
+    # Only the top 10 are rendered — no need for callers to sort the whole field
+    top = heapq.nlargest(10, ranking, key=itemgetter(1))
+    max_xp = top[0][1]
     curr_total = sum(item[1] for item in ranking)
     
     streak_label, broken_msg, king_msg, final_gif, current_king = "", "", "", None, ""
     if streak_cat:
-        icon, count, b_msg, k_msg, e_gif, king = update_period_streak(streak_cat, ranking[0][0])
+        icon, count, b_msg, k_msg, e_gif, king = update_period_streak(streak_cat, top[0][0])
         broken_msg, king_msg, final_gif, current_king = b_msg, k_msg, e_gif, king
         if icon == "👑": streak_label = f" {icon}"
         elif count >= 2: streak_label = f" {icon} {count}"
@@ -132,24 +205,23 @@ def send_discord_post(title, subtitle, ranking, color, dates, streak_cat=None, p
     if king_msg: full_desc += king_msg
 
     fields = []
-    medals = ["🥇", "🥈", "🥉"]
-    for i, (name, xp) in enumerate(ranking[:3]):
+    for i, (name, xp) in enumerate(top[:3]):
         pb_star = " ⭐️" if name in pb_list else ""
         king_tag = " 👑" if (name == current_king and (i != 0 or streak_cat != "daily")) else ""
         s_label = streak_label if (i == 0 and streak_cat) else king_tag
         pct = int((xp / max_xp) * 100) if max_xp > 0 else 0
         fields.append({
-            "name": f"{medals[i]} {name}{s_label}{pb_star}",
+            "name": f"{MEDALS[i]} {name}{s_label}{pb_star}",
             "value": f"`{xp:+,} XP`\n{make_bar(xp, max_xp)} `{pct}%`",
             "inline": False
         })
 
     others = []
-    for name, xp in ranking[3:10]:
+    for name, xp in top[3:10]:
         others.append(f"**{name}** (`{xp:+,} XP`){' ⭐️' if name in pb_list else ''}")
     if others: fields.append({"name": "--- Other Gains ---", "value": "\n".join(others), "inline": False})
 
-    legend = "⭐️=PB | 🔥=Streak"
+    legend = LEGEND_BASE
     if streak_cat == "daily":
         legend += " | 👑=King"
     footer_text = f"Team Total: {curr_total:,} XP\n{legend}"
@@ -165,51 +237,103 @@ def send_discord_post(title, subtitle, ranking, color, dates, streak_cat=None, p
     if final_gif:
         main_embed["image"] = {"url": final_gif}
 
-    requests.post(webhook, json={"embeds": [main_embed]})
+    return main_embed
+
+def embed_chars(embed):
+    total = len(embed.get("title", "")) + len(embed.get("description", "")) + len(embed.get("footer", {}).get("text", ""))
+    return total + sum(len(f.get("name", "")) + len(f.get("value", "")) for f in embed.get("fields", []))
+
+def post_discord_embeds(embeds):
+    # Discord allows up to 10 embeds / 6000 chars per webhook execution — one POST instead of one per report
+    webhook = os.environ.get("DISCORD_WEBHOOK_URL")
+    embeds = [e for e in embeds if e]
+    if not webhook or not embeds: return
+    session = get_session()
+    batch, batch_chars = [], 0
+    for embed in embeds:
+        chars = embed_chars(embed)
+        if batch and (len(batch) == 10 or batch_chars + chars > 6000):
+            session.post(webhook, json={"embeds": batch}, timeout=(5, 10))
+            batch, batch_chars = [], 0
+        batch.append(embed); batch_chars += chars
+    if batch:
+        session.post(webhook, json={"embeds": batch}, timeout=(5, 10))
 
 # ==========================================
 # ⚙️ HELPERS & MAIN ENGINE
 # ==========================================
-def get_summed_xp(logs, chars, days=None, month_prefix=None):
+_XP_DROP = str.maketrans("", "", "+,. ")
+
+@lru_cache(maxsize=4096)
+def xp_str_to_int(val):
+    # One C-level pass instead of a per-character genexp filter
+    s = str(val).translate(_XP_DROP)
+    if s.startswith('-'):
+        return -int(s[1:]) if s[1:].isdigit() else 0
+    return int(s) if s.isdigit() else 0
+
+def parse_logged_histories(logs, chars):
+    # Decode the formatted log strings ("+1,234") into ints once, shared by every report
+    parsed = {}
+    to_int = xp_str_to_int
+    for name in chars:
+        history = {}
+        for d, v in logs.get(name, {}).items():
+            val = to_int(v)
+            if val:
+                history[d] = val
+        parsed[name] = history
+    return parsed
+
+def get_summed_xp(histories, chars, days=None, month_prefix=None):
     rankings = []
     today = datetime.now(ZoneInfo(TIMEZONE))
     target_dates = [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(1, (days or 7) + 1)] if not month_prefix else []
-    
+
     for name in chars:
-        char_history = logs.get(name, {})
-        total = 0
-        
+        history = histories.get(name, {})
         if month_prefix:
-            for d, v in char_history.items():
-                if d.startswith(month_prefix):
-                    val_str = str(v)
-                    digits = "".join(c for c in val_str if c.isdigit())
-                    if digits:
-                        total += int(digits) * (-1 if val_str.startswith('-') else 1)
+            total = sum(v for d, v in history.items() if d.startswith(month_prefix))
         else:
-            for d in target_dates:
-                v = char_history.get(d)
-                if v:
-                    val_str = str(v)
-                    digits = "".join(c for c in val_str if c.isdigit())
-                    if digits:
-                        total += int(digits) * (-1 if val_str.startswith('-') else 1)
-        
+            total = sum(history.get(d, 0) for d in target_dates)
         if total != 0:
             rankings.append((name, total))
-            
-    rankings.sort(key=lambda x: x[1], reverse=True)
+
     return rankings
 
+_json_cache = {}
+
 def load_json(path, fallback=None):
-    if not path.exists(): return fallback or {}
-    try:
-        with open(path, "r") as f:
-            content = f.read().strip(); return json.loads(content) if content else (fallback or {})
-    except: return fallback or {}
+    # The streak/PB files are consulted several times per run — parse each file once
+    key = str(path)
+    if key in _json_cache: return _json_cache[key]
+    data = fallback or {}
+    if path.exists():
+        try:
+            with open(path, "rb") as f:
+                content = f.read().strip()
+            if content:
+                data = orjson.loads(content) if orjson else json.loads(content)
+        except: pass
+    _json_cache[key] = data
+    return data
 
-def save_json(path, data):
-    with open(path, "w") as f: json.dump(data, f, indent=2)
+def save_json(path, data, indent=True):
+    _json_cache[str(path)] = data
+    # Sorted keys keep the daily Actions diff line-stable as the log grows;
+    # machine-only sidecars skip the pretty-printing entirely
+    if orjson:
+        serialized = orjson.dumps(data, option=(orjson.OPT_INDENT_2 if indent else 0) | orjson.OPT_SORT_KEYS)
+    else:
+        serialized = json.dumps(data, indent=2 if indent else None, separators=None if indent else (",", ":"), sort_keys=True).encode()
+    try:
+        # No-op runs (e.g. cache hits) shouldn't rewrite the file and dirty the Actions commit;
+        # a size mismatch proves a change without reading the old bytes at all
+        if path.exists() and path.stat().st_size == len(serialized) and path.read_bytes() == serialized: return
+    except: pass
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f: f.write(serialized)
+    os.replace(tmp, path)
 
 def get_dates():
     tz = ZoneInfo(TIMEZONE); now = datetime.now(tz); yesterday_obj = now - timedelta(days=1)
@@ -217,30 +341,50 @@ def get_dates():
 
 def main():
     dates = get_dates(); logs, state = load_json(LOG_PATH), load_json(STATE_PATH)
+    yesterday = dates['yesterday_iso']
     if not CHAR_FILE.exists(): return
     with open(CHAR_FILE) as f: chars = [l.strip() for l in f if l.strip()]
 
-    print(f"🌐 Scraping {dates['yesterday_iso']}...")
+    logger.info(f"🌐 Scraping {yesterday}...")
     current_scrapes = {}; daily_pb_achievers = []; total_non_zero = 0
+    etags = load_json(ETAGS_PATH, {})
 
-    for name in chars:
-        gain = fetch_data(name, dates)
-        current_scrapes[name] = gain
-        if gain != 0: total_non_zero += 1
-        time.sleep(1.5)
+    def scrape_or_cached(name):
+        # Re-runs the same day: the log already holds yesterday's row, skip the round-trip
+        try:
+            cached = logs.get(name, {}).get(yesterday)
+            if cached is not None:
+                val = xp_str_to_int(cached)
+                # A logged zero may just mean the row wasn't published yet — refetch so the
+                # log can heal on re-runs (the conditional GET keeps the retry a cheap 304)
+                if val: return val
+            return fetch_data(name, dates, etags)
+        except Exception as e:
+            # One broken character must not take the whole batch down
+            logger.info(f"⚠️ {name}: {e}")
+            return 0
+
+    workers = max(1, int(os.environ.get("SCRAPE_WORKERS", "4")))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for name, gain in zip(chars, pool.map(scrape_or_cached, chars)):
+            current_scrapes[name] = gain
+            if gain != 0: total_non_zero += 1
+
+    save_json(ETAGS_PATH, etags, indent=False)
 
     if total_non_zero == 0:
-        print(f"🛑 ANTI-ZERO TRIGGERED."); return 
+        logger.info("🛑 ANTI-ZERO TRIGGERED."); return
 
+    daily_ranks = []
     for name, gain in current_scrapes.items():
-        if name not in logs: logs[name] = {}
-        logs[name][dates['yesterday_iso']] = f"{gain:+,}"
+        logs.setdefault(name, {})[yesterday] = f"{gain:+,}"
+        if gain != 0: daily_ranks.append((name, gain))
         if gain > 0 and update_personal_best(name, gain): daily_pb_achievers.append(name)
     
     save_json(LOG_PATH, logs)
 
     # ⚔️ KING DEATH ENGINE: Strip crown if King drops daily XP ⚔️
-    all_streaks = load_json(STREAKS_PATH, {"daily":{}, "weekly":{}, "monthly":{}, "reigning_king": ""})
+    all_streaks = load_json(STREAKS_PATH, default_streaks())
     reigning_king = all_streaks.get("reigning_king", "")
     king_died_msg = ""
     
@@ -252,28 +396,34 @@ def main():
             all_streaks["daily"] = {"last_winner": "", "count": 0}
         save_json(STREAKS_PATH, all_streaks)
 
-    if dates['is_monday'] and state.get("last_weekly") != dates['yesterday_iso']:
-        r = get_summed_xp(logs, chars, days=7)
-        if r: send_discord_post("Weekly XP Totals", "🗓️ Period: **Last 7 Days**", r, 0x3498db, dates, "weekly")
-        state["last_weekly"] = dates['yesterday_iso']
+    embeds = []
+    weekly_due = dates['is_monday'] and state.get("last_weekly") != yesterday
+    monthly_due = dates['is_first'] and state.get("last_monthly") != yesterday
+    histories = parse_logged_histories(logs, chars) if (weekly_due or monthly_due) else {}
 
-    if dates['is_first'] and state.get("last_monthly") != dates['yesterday_iso']:
-        r = get_summed_xp(logs, chars, month_prefix=dates['month_filter'])
-        if r: send_discord_post("Monthly XP Totals", f"🗓️ Month: **{dates['month_name']}**", r, 0xf1c40f, dates, "monthly")
-        state["last_monthly"] = dates['yesterday_iso']
+    if weekly_due:
+        r = get_summed_xp(histories, chars, days=7)
+        if r: embeds.append(build_discord_embed("Weekly XP Totals", "🗓️ Period: **Last 7 Days**", r, 0x3498db, dates, "weekly"))
+        state["last_weekly"] = yesterday
 
-    daily_ranks = [(name, gain) for name, gain in current_scrapes.items() if gain != 0]
-    if daily_ranks and state.get("last_daily") != dates['yesterday_iso']:
-        daily_ranks.sort(key=lambda x: x[1], reverse=True)
-        
+    if monthly_due:
+        r = get_summed_xp(histories, chars, month_prefix=dates['month_filter'])
+        if r: embeds.append(build_discord_embed("Monthly XP Totals", f"🗓️ Month: **{dates['month_name']}**", r, 0xf1c40f, dates, "monthly"))
+        state["last_monthly"] = yesterday
+
+    if daily_ranks and state.get("last_daily") != yesterday:
         sub_text = f"🗓️ Date: **{dates['yesterday_display']}**"
         if king_died_msg:
             sub_text += king_died_msg
             
-        send_discord_post("Daily Champion", sub_text, daily_ranks, 0x2ecc71, dates, "daily", pb_list=daily_pb_achievers)
-        state["last_daily"] = dates['yesterday_iso']
+        embeds.append(build_discord_embed("Daily Champion", sub_text, daily_ranks, 0x2ecc71, dates, "daily", pb_list=daily_pb_achievers))
+        state["last_daily"] = yesterday
 
+    # Overlap the webhook round-trip with the state write instead of serializing them
+    poster = threading.Thread(target=post_discord_embeds, args=(embeds,))
+    poster.start()
     save_json(STATE_PATH, state)
+    poster.join(timeout=30)
 
 if __name__ == "__main__":
     main()